@@ -1,14 +1,35 @@
 # app.py — Technolab Data Center (IconLayer 🚜 + ruta óptima con API ORS + MATRIZ)
 # -*- coding: utf-8 -*-
 import os
-import re
-from math import radians, sin, cos, asin, sqrt
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
+import pydeck as pdk
 import requests
 import streamlit as st
-from sqlalchemy import create_engine, text, event
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from sqlalchemy import create_engine, text
+from sqlalchemy.sql.elements import TextClause
+from exportacion import csv_bytes
+from sentencias import (
+    PAGE_SIZE,
+    SQL_BIORREACTORES,
+    SQL_BIORREACTOR_POR_BIM,
+    SQL_CLIENTES,
+    SQL_CONTEOS,
+    SQL_CSV,
+    SQL_DIAGNOSTICOS,
+    SQL_DIAGNOSTICO_POR_ID,
+    SQL_EVENTOS,
+    SQL_KPIS,
+    SQL_REGISTROS,
+    SQL_REGISTRO_POR_ID,
+)
+from datetime import date, datetime, timedelta
 
 st.set_page_config(page_title="Technolab Data Center", page_icon="🧪", layout="wide")
 
@@ -42,6 +63,7 @@ a.btn-link:hover { background:#1e293b; }
 # ==========================================================
 # Conexión MySQL
 # ==========================================================
+@st.cache_resource
 def build_engine():
     if "mysql" in st.secrets:
         user     = st.secrets["mysql"]["user"]
@@ -61,15 +83,16 @@ def build_engine():
         url,
         pool_pre_ping=True,
         pool_recycle=1800,
-        connect_args={"charset": "utf8mb4"},
+        pool_size=10,        # sesiones concurrentes de Streamlit comparten este pool
+        max_overflow=20,
+        pool_timeout=30,
+        connect_args={
+            "charset": "utf8mb4",
+            # Se envía al abrir cada conexión, sin cursor ni listener aparte.
+            # SET NAMES ... COLLATE fija también collation_connection.
+            "init_command": "SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci",
+        },
     )
-
-    @event.listens_for(engine, "connect")
-    def _set_session_collation(dbapi_conn, _):
-        cur = dbapi_conn.cursor()
-        cur.execute("SET NAMES utf8mb4;")
-        cur.execute("SET collation_connection = 'utf8mb4_unicode_ci';")
-        cur.close()
     return engine
 
 ENGINE = build_engine()
@@ -77,105 +100,214 @@ ENGINE = build_engine()
 # ==========================================================
 # Utilitarios
 # ==========================================================
-def q(sql: str, params: dict | None = None) -> pd.DataFrame:
+QUERY_CHUNKSIZE = 50_000
+
+def q(sql: str | TextClause, params: dict | None = None, arrow: bool = False,
+      stream: bool = False, lanzar: bool = False) -> pd.DataFrame:
+    """
+    Ejecuta una consulta y devuelve un DataFrame (vacío si hay error).
+    Con `arrow=True` las columnas quedan en dtypes de PyArrow: menos memoria en textos
+    largos y sin conversión extra al mostrarlas con st.dataframe.
+    Con `stream=True` se lee con cursor del lado del servidor, por bloques de
+    QUERY_CHUNKSIZE filas: para resultados potencialmente grandes (rangos completos).
+    Con `lanzar=True` el error se propaga en vez de mostrarse: así una función
+    cacheada no guarda el resultado vacío de una consulta fallida.
+    """
+    kwargs = {"dtype_backend": "pyarrow"} if arrow else {}
     try:
-        return pd.read_sql(text(sql), ENGINE, params=params)
+        stmt = text(sql) if isinstance(sql, str) else sql
+        if not stream:
+            with ENGINE.connect() as conn:
+                return pd.read_sql(stmt, conn, params=params, **kwargs)
+
+        # Cursor del lado del servidor (SSCursor): pymysql no bufferiza todo el resultado
+        with ENGINE.connect().execution_options(stream_results=True) as conn:
+            chunks = list(pd.read_sql(stmt, conn, params=params, chunksize=QUERY_CHUNKSIZE, **kwargs))
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
     except Exception as e:
+        if lanzar:
+            raise
         st.error(f"Error de consulta SQL: {e}")
         return pd.DataFrame()
 
-def _norm_bim_series(s: pd.Series) -> pd.Series:
-    x = s.astype("string").fillna("").str.strip()
-    x = x.str.replace(r"^\s*bim\s*", "", regex=True)
-    x = x.str.lower().replace({"none":"", "null":"", "ninguno":""})
-    return x
-
-_coord_pattern = re.compile(r"[-+]?\d+(?:[.,]\d+)?")
-def _to_float_coord(val):
-    if pd.isna(val):
-        return None
-    s = str(val).strip()
-    m = _coord_pattern.search(s)
-    if not m:
-        return None
+def q_one(sql: str | TextClause, params: dict | None = None, lanzar: bool = False):
+    """
+    Primera fila de la consulta como Row (tupla con atributos), sin construir un
+    DataFrame: para conteos y resultados escalares. None si no hay filas o hay error
+    (con `lanzar=True`, el error se propaga como en q).
+    """
     try:
-        return float(m.group(0).replace(",", "."))
-    except Exception:
+        stmt = text(sql) if isinstance(sql, str) else sql
+        with ENGINE.connect() as conn:
+            return conn.execute(stmt, params or {}).first()
+    except Exception as e:
+        if lanzar:
+            raise
+        st.error(f"Error de consulta SQL: {e}")
         return None
 
+def _en_paralelo(*llamadas):
+    """
+    Ejecuta cada llamada `(func, *args)` en un hilo y devuelve los resultados en orden
+    (None para las entradas None o las que fallaron). Pensado para consultas
+    independientes a MySQL: pymysql libera el GIL mientras espera la red, así la
+    latencia total es la de la más lenta y no la suma. Las funciones deben ser solo
+    E/S de base de datos (cachés con show_spinner=False) y lanzar sus errores; aquí se
+    capturan y se muestran al final, desde el hilo del script.
+    """
+    ctx = get_script_run_ctx()
+    errores: list[str] = []
+
+    def _llamar(llamada):
+        if llamada is None:
+            return None
+        func, *args = llamada
+        try:
+            return func(*args)
+        except Exception as e:
+            errores.append(f"Error de consulta SQL: {e}")
+            return None
+
+    def _en_hilo(llamada):
+        add_script_run_ctx(threading.current_thread(), ctx)  # para st.cache_* en el hilo
+        return _llamar(llamada)
+
+    pendientes = [ll for ll in llamadas if ll is not None]
+    if len(pendientes) <= 1:
+        resultados = [_llamar(ll) for ll in llamadas]
+    else:
+        with ThreadPoolExecutor(max_workers=len(pendientes)) as ex:
+            resultados = list(ex.map(_en_hilo, llamadas))
+    for msg in dict.fromkeys(errores):
+        st.error(msg)
+    return resultados
+
+_COORD_PATTERN = r"([-+]?\d+(?:[.,]\d+)?)"
+def _to_float_coords(col: pd.Series) -> pd.Series:
+    """
+    Coordenadas como float64 (NaN si no hay número), en una pasada vectorizada:
+    primer número del texto, admitiendo coma decimal.
+    """
+    x = (
+        col.astype("string")
+        .str.extract(_COORD_PATTERN, expand=False)
+        .str.replace(",", ".", regex=False)
+    )
+    return pd.to_numeric(x, errors="coerce").astype("float64")
+
 # --- Distancia y orden aproximado (para TSP básico) ---
-def haversine_km(lat1, lon1, lat2, lon2) -> float:
-    """Distancia aproximada en km entre dos puntos (lat, lon) usando haversine."""
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Distancia aproximada en km entre puntos (lat, lon) usando haversine.
+    Acepta escalares o arrays de NumPy (se aplica elemento a elemento).
+    """
     R = 6371.0  # radio de la Tierra en km
-    lat1_r, lon1_r = radians(lat1), radians(lon1)
-    lat2_r, lon2_r = radians(lat2), radians(lon2)
+    lat1_r, lon1_r = np.radians(lat1), np.radians(lon1)
+    lat2_r, lon2_r = np.radians(lat2), np.radians(lon2)
     dlat = lat2_r - lat1_r
     dlon = lon2_r - lon1_r
 
-    a = sin(dlat / 2)**2 + cos(lat1_r) * cos(lat2_r) * sin(dlon / 2)**2
-    c = 2 * asin(sqrt(a))
+    a = np.sin(dlat / 2)**2 + np.cos(lat1_r) * np.cos(lat2_r) * np.sin(dlon / 2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
     return R * c
 
+def _matriz_distancias(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Matriz NxN de distancias haversine (km) por broadcasting, calculada una sola vez."""
+    return haversine_km(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+
+def _mejorar_2opt(orden: list[int], D: np.ndarray) -> list[int]:
+    """
+    Refinamiento 2-opt de un recorrido ABIERTO con el primer punto fijo (Matriz si
+    está incluida): invierte tramos mientras eso acorte la distancia total.
+    """
+    orden = list(orden)
+    n = len(orden)
+    mejoro = True
+    while mejoro:
+        mejoro = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b, c = orden[i - 1], orden[i], orden[j]
+                antes = D[a, b]
+                despues = D[a, c]
+                if j + 1 < n:  # el último tramo no tiene arco de salida
+                    d = orden[j + 1]
+                    antes += D[c, d]
+                    despues += D[b, d]
+                if despues < antes - 1e-9:
+                    orden[i:j + 1] = orden[i:j + 1][::-1]
+                    mejoro = True
+    return orden
+
 def build_route_nearest_neighbor(df_points: pd.DataFrame) -> pd.DataFrame:
     """
     Recibe un DataFrame con columnas: cliente, numero_bim, latitud, longitud
-    Devuelve el mismo DataFrame ordenado según una ruta aproximada (nearest neighbor).
+    Devuelve el mismo DataFrame ordenado según una ruta aproximada
+    (nearest neighbor + refinamiento 2-opt).
     """
     if df_points.empty or len(df_points) == 1:
         return df_points.reset_index(drop=True)
 
-    remaining = df_points.copy().reset_index(drop=True)
-    route_rows = []
+    lat = df_points["latitud"].to_numpy(dtype=np.float64)
+    lon = df_points["longitud"].to_numpy(dtype=np.float64)
+    D = _matriz_distancias(lat, lon)
+    visitado = np.zeros(len(df_points), dtype=bool)
 
     # Partimos desde el primer punto (puedes cambiar la lógica de partida si quieres)
-    current_idx = 0
-    route_rows.append(remaining.loc[current_idx])
-    remaining = remaining.drop(index=current_idx).reset_index(drop=True)
-
-    while not remaining.empty:
-        last_lat = route_rows[-1]["latitud"]
-        last_lon = route_rows[-1]["longitud"]
-
-        # Encontrar el más cercano
-        dists = remaining.apply(
-            lambda r: haversine_km(last_lat, last_lon, r["latitud"], r["longitud"]),
-            axis=1
-        )
-        next_idx = dists.idxmin()
-        route_rows.append(remaining.loc[next_idx])
-        remaining = remaining.drop(index=next_idx).reset_index(drop=True)
-
-    route_df = pd.DataFrame(route_rows).reset_index(drop=True)
-    return route_df
+    actual = 0
+    orden = [actual]
+    visitado[actual] = True
+
+    while len(orden) < len(df_points):
+        # Fila del punto actual, con los ya visitados descartados
+        dists = np.where(visitado, np.inf, D[actual])
+        actual = int(np.argmin(dists))
+        orden.append(actual)
+        visitado[actual] = True
+
+    orden = _mejorar_2opt(orden, D)
+    return df_points.iloc[orden].reset_index(drop=True)
+
+# Sesión HTTP reutilizable: mantiene viva la conexión TLS con ORS entre llamadas y
+# reintenta (con backoff) ante límites de tasa y errores transitorios del gateway.
+# Como recurso cacheado (igual que el engine): app.py se re-ejecuta en cada rerun.
+@st.cache_resource
+def _ors_session() -> requests.Session:
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=4,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.3,
+                status_forcelist=[429, 502, 503, 504],
+                allowed_methods=None,  # POST de solo lectura: seguro de reintentar
+            ),
+        ),
+    )
+    return session
 
-def get_driving_route_ors(coords):
+@st.cache_data(ttl=3600, max_entries=64, show_spinner="Consultando ruta por carretera…")
+def _ors_route(coord_tuple: tuple) -> tuple[float, float, list]:
     """
-    Llama a la API de OpenRouteService para obtener la ruta por carretera.
-    coords debe ser una lista de [lon, lat] en el orden de visita.
-    Devuelve (distancia_km, duracion_horas, geometria_coords) o (None, None, None) si hay error.
+    POST a OpenRouteService para una secuencia fija de (lon, lat). La respuesta solo
+    depende de las coordenadas, así que se cachea por ellas. Los errores se propagan
+    como excepción para que NO queden cacheados.
     """
-    if "ors" not in st.secrets or "api_key" not in st.secrets["ors"]:
-        st.error("Falta configurar st.secrets['ors']['api_key'] con tu API Key de OpenRouteService.")
-        return None, None, None
-
-    api_key = st.secrets["ors"]["api_key"]
     url = "https://api.openrouteservice.org/v2/directions/driving-car/geojson"
-
     headers = {
-        "Authorization": api_key,
+        "Authorization": st.secrets["ors"]["api_key"],
         "Content-Type": "application/json",
     }
     body = {
-        "coordinates": coords,
+        "coordinates": [list(c) for c in coord_tuple],
     }
 
-    try:
-        resp = requests.post(url, json=body, headers=headers, timeout=20)
-        resp.raise_for_status()
-        data = resp.json()
-    except Exception as e:
-        st.error(f"Error al llamar a la API de rutas: {e}")
-        return None, None, None
+    resp = _ors_session().post(url, json=body, headers=headers, timeout=20)
+    resp.raise_for_status()
+    data = resp.json()
 
     try:
         feat = data["features"][0]
@@ -184,8 +316,25 @@ def get_driving_route_ors(coords):
         duracion_h  = summary["duration"] / 3600.0       # segundos → horas
         geometria   = feat["geometry"]["coordinates"]    # lista [lon, lat]
         return distancia_km, duracion_h, geometria
+    except (KeyError, IndexError, TypeError) as e:
+        raise ValueError(f"Respuesta inesperada de la API de rutas: {e}") from e
+
+def get_driving_route_ors(coords):
+    """
+    Llama a la API de OpenRouteService para obtener la ruta por carretera.
+    coords debe ser una lista de [lon, lat] en el orden de visita.
+    Devuelve (distancia_km, duracion_horas, geometria_coords) o (None, None, None) si hay error.
+    """
+    if "ors" not in st.secrets or "api_key" not in st.secrets["ors"]:
+        st.error("Falta configurar st.secrets['ors']['api_key'] con tu API Key de OpenRouteService.")
+        return None, None, None
+
+    # Tupla redondeada (~10 cm): clave de caché estable ante ruido de coma flotante
+    coord_tuple = tuple((round(float(lon), 6), round(float(lat), 6)) for lon, lat in coords)
+    try:
+        return _ors_route(coord_tuple)
     except Exception as e:
-        st.error(f"Respuesta inesperada de la API de rutas: {e}")
+        st.error(f"Error al llamar a la API de rutas: {e}")
         return None, None, None
 
 # ==========================================================
@@ -193,36 +342,54 @@ def get_driving_route_ors(coords):
 # ==========================================================
 @st.cache_data(ttl=180)
 def get_clientes() -> pd.DataFrame:
-    return q("SELECT id, usuario_id, usuario_nombre, cliente, BIMs_instalados FROM clientes")
+    return q(SQL_CLIENTES)
+
+# ↓↓↓ biorreactores y mapa: TTL de 30 s + botón "Refrescar" para ver cambios al instante ↓↓↓
+CATALOGO_TTL = 30
 
-# ↓↓↓ biorreactores y mapa con TTL = 1s para ver cambios rápido ↓↓↓
-@st.cache_data(ttl=1)
+# Recurso compartido (sin copia por llamada): home y mapa solo lo leen o
+# lo filtran; ninguna función debe asignarle columnas en sitio.
+@st.cache_resource(ttl=CATALOGO_TTL)
 def get_biorreactores() -> pd.DataFrame:
-    return q("""
-        SELECT
-           id,
-           cliente,
-           TRIM(CAST(numero_bim AS CHAR CHARACTER SET utf8mb4)) AS numero_bim,
-           latitud, longitud, altura_bim,
-           tipo_microalga, uso_luz_artificial, tipo_aireador,
-           `fecha_instalación` AS fecha_instalacion
-        FROM biorreactores
-        ORDER BY cliente, numero_bim
-    """)
-
-@st.cache_data(ttl=1)
+    df = q(SQL_BIORREACTORES)
+    if "numero_bim" in df:
+        # Un único cast aquí (cacheado): botones del home, etiquetas del mapa y
+        # selectores reutilizan la misma columna sin re-convertirla en cada rerun.
+        df["numero_bim"] = df["numero_bim"].astype("string[pyarrow]")
+    if "cliente" in df:
+        # Categórica ordenada: las categorías ya vienen únicas y ordenadas (opciones del
+        # selector) y groupby/filtros trabajan sobre códigos enteros, no sobre strings.
+        df["cliente"] = pd.Categorical(df["cliente"], ordered=True)
+    return df
+
+@st.cache_data(ttl=CATALOGO_TTL, max_entries=256)
+def get_biorreactor(bim: str) -> pd.Series | None:
+    """Ficha de un BIM (una fila, pedida a MySQL), o None si no existe."""
+    df = q(SQL_BIORREACTOR_POR_BIM, {"bim": str(bim)})
+    if df.empty:
+        return None
+
+    # Textos de la cabecera del detalle
+    luz = df["uso_luz_artificial"]
+    df = df.assign(
+        luz_display=luz.fillna(0).astype(bool).map({True: "Sí", False: "No"}).where(luz.notna(), "—"),
+    )
+    return df.iloc[0]
+
+@st.cache_data(ttl=CATALOGO_TTL)
 def get_map_df(cliente_sel: str | None = None) -> pd.DataFrame:
     """
     Devuelve el catálogo de BIMs SOLO para el mapa.
     Aquí se inyecta el BIM sintético 'Matriz' (Casa Matriz Technolab).
     """
-    cat = get_biorreactores().copy()
+    cat = get_biorreactores()  # objeto compartido: no asignar columnas en sitio
     if cliente_sel and cliente_sel != "Todos":
-        cat = cat[cat["cliente"].fillna("").str.strip() == cliente_sel]
+        cat = cat[cat["cliente"] == cliente_sel]
 
-    cat["latitud"]  = cat["latitud"].map(_to_float_coord)
-    cat["longitud"] = cat["longitud"].map(_to_float_coord)
-    cat = cat.dropna(subset=["latitud","longitud"])
+    cat = cat.assign(
+        latitud=_to_float_coords(cat["latitud"]),
+        longitud=_to_float_coords(cat["longitud"]),
+    ).dropna(subset=["latitud","longitud"])
 
     # Iconos Twemoji
     tractor_icon_cfg = {
@@ -243,7 +410,7 @@ def get_map_df(cliente_sel: str | None = None) -> pd.DataFrame:
 
     # Campos normales de los BIMs de la base
     if not cat.empty:
-        cat["label"] = "BIM " + cat["numero_bim"].astype("string")
+        cat["label"] = "BIM " + cat["numero_bim"]
         cat["icon_data"] = [tractor_icon_cfg] * len(cat)
 
     # --- Agregar BIM sintético MATRIZ (Casa Matriz Technolab) ---
@@ -260,88 +427,119 @@ def get_map_df(cliente_sel: str | None = None) -> pd.DataFrame:
 
     return cat[["cliente","numero_bim","latitud","longitud","tipo_microalga","label","icon_data"]]
 
-@st.cache_data(ttl=180)
-def get_eventos(bim: str, d1: datetime, d2: datetime) -> pd.DataFrame:
-    return q("""
-        SELECT id, numero_bim, nombre_evento, fecha, comentarios
-        FROM fechas_BIMs
-        WHERE numero_bim = :bim AND fecha BETWEEN :d1 AND :d2
-        ORDER BY fecha DESC
-    """, {"bim": str(bim), "d1": d1, "d2": d2})
-
-@st.cache_data(ttl=180)
-def get_diagnosticos(bim: str, d1: datetime, d2: datetime) -> pd.DataFrame:
-    return q("""
-        SELECT d.id, d.usuario_id, d.PreguntaCliente, d.respuestaGPT, d.fecha
-        FROM diagnosticos d
-        WHERE d.usuario_id IN (SELECT r.usuario_id FROM registros r WHERE r.BIM = :bim)
-          AND d.fecha BETWEEN :d1 AND :d2
-        ORDER BY d.fecha DESC
-    """, {"bim": str(bim), "d1": d1, "d2": d2})
-
-@st.cache_data(ttl=180)
-def get_registros(bim: str, d1: datetime, d2: datetime) -> pd.DataFrame:
-    return q("""
-        SELECT id, usuario_id, BIM, respuestaGPT, HEX, fecha
-        FROM registros
-        WHERE BIM = :bim AND fecha BETWEEN :d1 AND :d2
-        ORDER BY fecha DESC
-    """, {"bim": str(bim), "d1": d1, "d2": d2})
+def _rango_params(bim: str, d1: date, d2: date) -> dict:
+    """Rango [d1, d2] inclusivo como `fecha >= d1 AND fecha < d2+1`: sargable con índices DATE o DATETIME."""
+    return {"bim": str(bim), "d1": d1, "d2": d2 + timedelta(days=1)}
+
+def _pagina_params(bim: str, d1: date, d2: date, pagina: int) -> dict:
+    params = _rango_params(bim, d1, d2)
+    params.update(lim=PAGE_SIZE, off=(max(int(pagina), 1) - 1) * PAGE_SIZE)
+    return params
+
+# Las tres consultas del detalle se cachean como recurso: todas las sesiones reciben
+# el MISMO DataFrame (sin copia por rerun). Son de solo lectura: no mutarlos.
+@st.cache_resource(ttl=180, max_entries=64, show_spinner=False)
+def get_eventos(bim: str, d1: date, d2: date, pagina: int = 1) -> pd.DataFrame:
+    """Una página de PAGE_SIZE eventos."""
+    return q(SQL_EVENTOS[False], _pagina_params(bim, d1, d2, pagina), arrow=True, lanzar=True)
+
+@st.cache_resource(ttl=180, max_entries=64, show_spinner=False)
+def get_diagnosticos(bim: str, d1: date, d2: date, pagina: int = 1) -> pd.DataFrame:
+    """Una página de diagnósticos con los textos largos recortados."""
+    return q(SQL_DIAGNOSTICOS[False], _pagina_params(bim, d1, d2, pagina), arrow=True, lanzar=True)
+
+@st.cache_resource(ttl=180, max_entries=64, show_spinner=False)
+def get_registros(bim: str, d1: date, d2: date, pagina: int = 1) -> pd.DataFrame:
+    """Una página de registros con respuestaGPT recortada."""
+    return q(SQL_REGISTROS[False], _pagina_params(bim, d1, d2, pagina), arrow=True, lanzar=True)
+
+@st.cache_data(ttl=180, max_entries=256, show_spinner=False)
+def get_conteo(tabla: str, bim: str, d1: date, d2: date) -> int:
+    row = q_one(SQL_CONTEOS[tabla], _rango_params(bim, d1, d2), lanzar=True)
+    return int(row.n) if row is not None else 0
+
+# CSV completos: pocos y potencialmente grandes, cupo más bajo
+@st.cache_data(ttl=180, max_entries=16)
+def get_csv(tabla: str, bim: str, d1: date, d2: date) -> bytes:
+    """
+    CSV ya codificado de una pestaña del detalle (rango completo, textos completos).
+    Solo se pide cuando el usuario lo prepara; el DataFrame completo es temporal
+    y únicamente quedan cacheados los bytes.
+    """
+    df = q(SQL_CSV[tabla], _rango_params(bim, d1, d2), arrow=True, stream=True)
+    return csv_bytes(df)
+
+def _descarga_csv(tabla: str, bim: str, d1: date, d2: date):
+    """Botón de descarga del CSV completo, armado solo si el usuario lo pide."""
+    if st.toggle("Preparar CSV del rango completo", key=f"csv_{tabla}"):
+        st.download_button("Descargar CSV", get_csv(tabla, bim, d1, d2), file_name=f"{tabla}_BIM{bim}.csv")
+
+@st.cache_data(ttl=180, max_entries=128)
+def get_registro(reg_id: int) -> pd.DataFrame:
+    """Fila completa de un registro, pedida sólo cuando el usuario la selecciona."""
+    return q(SQL_REGISTRO_POR_ID, {"id": int(reg_id)})
+
+@st.cache_data(ttl=180, max_entries=128)
+def get_diagnostico(diag_id: int) -> pd.DataFrame:
+    """Fila completa de un diagnóstico, pedida sólo cuando el usuario la selecciona."""
+    return q(SQL_DIAGNOSTICO_POR_ID, {"id": int(diag_id)})
+
+@st.cache_data(ttl=CATALOGO_TTL)
+def get_clientes_opts() -> list[str]:
+    """Opciones del selector de cliente (se calculan una vez por TTL, no por rerun)."""
+    bio_df = get_biorreactores()
+    if "cliente" not in bio_df:
+        return ["Todos"]
+    return ["Todos"] + [c for c in bio_df["cliente"].cat.categories if c != ""]
+
+def refrescar_catalogo():
+    """Descarta el catálogo cacheado y sus derivados (botón "Refrescar")."""
+    for fn in (get_biorreactores, get_biorreactor, get_map_df, get_clientes_opts):
+        fn.clear()
 
 # ==========================================================
 # KPIs
 # ==========================================================
 @st.cache_data(ttl=180)
 def get_kpis():
-    c = q("SELECT COUNT(*) AS c FROM clientes")
-    total_clientes = int(c["c"].iloc[0]) if not c.empty else 0
-
-    sum_cli_df = q("SELECT SUM(COALESCE(BIMs_instalados,0)) AS s FROM clientes")
-    sum_clientes = int(sum_cli_df["s"].iloc[0]) if not sum_cli_df.empty else 0
+    row = q_one(SQL_KPIS)
+    if row is None:
+        return 0, 0, 0, 0, 0
 
-    df_bio = q("SELECT numero_bim FROM biorreactores WHERE numero_bim IS NOT NULL")
-    distinct_bims = int(df_bio["numero_bim"].drop_duplicates().shape[0]) if not df_bio.empty else 0
-    total_bims = max(sum_clientes, distinct_bims)
-
-    d = q("SELECT COUNT(*) AS c FROM diagnosticos")
-    total_diag = int(d["c"].iloc[0]) if not d.empty else 0
-    r = q("SELECT COUNT(*) AS c FROM registros")
-    total_regs = int(r["c"].iloc[0]) if not r.empty else 0
-    e = q("SELECT COUNT(*) AS c FROM fechas_BIMs")
-    total_eventos = int(e["c"].iloc[0]) if not e.empty else 0
-
-    return total_clientes, total_bims, total_diag, total_regs, total_eventos
+    total_bims = max(int(row.sc), int(row.db))
+    return int(row.tc), total_bims, int(row.td), int(row.tr), int(row.te)
 
 # ==========================================================
 # Navegación
 # ==========================================================
-def go_home():
-    st.session_state.page = "home"
-    st.session_state.selected_bim = None
+# La URL (st.query_params) es la única fuente de verdad de la página y el BIM:
+# los enlaces "?page=..." y los botones navegan por el mismo camino.
+def go_home(aviso: str | None = None):
+    """Vuelve al panel general; `aviso` se muestra allí después del rerun."""
+    if aviso:
+        st.session_state["aviso_home"] = aviso
     st.query_params.clear()
     st.query_params["page"] = "home"
+    st.rerun()
 
 def go_detail(bim: str):
-    st.session_state.page = "detail"
-    st.session_state.selected_bim = str(bim)
     st.query_params.clear()
     st.query_params.update({"page": "detail", "bim": str(bim)})
+    st.rerun()
 
 def go_map():
-    st.session_state.page = "map"
     st.query_params.clear()
     st.query_params["page"] = "map"
-
-if "page" not in st.session_state:
-    st.session_state.page = st.query_params.get("page", "home")
-if "selected_bim" not in st.session_state:
-    st.session_state.selected_bim = st.query_params.get("bim", None)
+    st.rerun()
 
 # ==========================================================
 # Página principal
 # ==========================================================
 def view_home():
     st.title("🧠 Technolab Data Center — Panel General")
+    aviso = st.session_state.pop("aviso_home", None)
+    if aviso:
+        st.info(aviso)
 
     tc, tb, td, tr, te = get_kpis()
     k1, k2, k3, k4, k5 = st.columns(5)
@@ -353,13 +551,9 @@ def view_home():
 
     # --- Filtros laterales + acceso al mapa ---
     st.sidebar.title("Filtros de visualización")
-    bio_df = get_biorreactores().copy()
-    bio_df["cliente"] = bio_df["cliente"].astype("string")
+    bio_df = get_biorreactores()
 
-    clientes_opts = ["Todos"] + sorted(
-        [c for c in bio_df["cliente"].dropna().str.strip().unique().tolist() if c != ""]
-    )
-    cliente_sel = st.sidebar.selectbox("Cliente", clientes_opts, key="cliente_sel_home")
+    cliente_sel = st.sidebar.selectbox("Cliente", get_clientes_opts(), key="cliente_sel_home")
 
     if st.sidebar.button("🌍 Abrir mapa de biorreactores"):
         go_map()
@@ -369,25 +563,69 @@ def view_home():
     st.subheader("📋 Listado de biorreactores")
 
     if cliente_sel != "Todos":
-        bio_df = bio_df[bio_df["cliente"].fillna("").str.strip() == cliente_sel]
+        bio_df = bio_df[bio_df["cliente"] == cliente_sel]
 
     if bio_df.empty:
         st.warning("No se encontraron biorreactores para el filtro aplicado.")
     else:
-        for cliente, grp in bio_df.groupby(bio_df["cliente"].fillna("").str.strip(), dropna=False):
+        for cliente, grp in bio_df.groupby("cliente", sort=False, observed=True):
             if cliente:
                 st.markdown(f"### 👤 {cliente}")
 
+            # Etiquetas y keys armadas en bloque sobre la columna string[pyarrow] cacheada
+            # (sin re-cast); un BIM NULL no tiene detalle al que navegar.
+            bims = grp["numero_bim"].dropna()
+            labels = ("🌿 BIM " + bims).tolist()
+            keys = (f"btn_bim_{cliente or 'sin_cliente'}_" + bims).tolist()
+
             cols = st.columns(3)
-            for i, (_, r) in enumerate(grp.iterrows()):
+            for i, (label_btn, key, bim_no) in enumerate(zip(labels, keys, bims.tolist())):
                 with cols[i % 3]:
-                    label_btn = f"🌿 BIM {r['numero_bim']}"
-                    if st.button(label_btn, key=f"btn_bim_{cliente or 'sin_cliente'}_{r['numero_bim']}"):
-                        go_detail(str(r["numero_bim"]))
+                    if st.button(label_btn, key=key):
+                        go_detail(bim_no)
 
 # ==========================================================
 # Página del mapa (ventana propia) + ruta óptima real por carretera
 # ==========================================================
+_COLS_FIRMA_MAPA = ["cliente", "numero_bim", "latitud", "longitud", "tipo_microalga", "label"]
+
+def _firma_mapa(df_map: pd.DataFrame) -> int:
+    """Huella vectorizada del contenido visible del mapa (clave de caché de las capas)."""
+    return int(pd.util.hash_pandas_object(df_map[_COLS_FIRMA_MAPA], index=False).sum())
+
+@st.cache_resource(ttl=180, max_entries=8)
+def _capas_base(_df_map: pd.DataFrame, firma: int):
+    """
+    Capas IconLayer + TextLayer del mapa. pydeck serializa los datos al construir
+    cada capa, así que se cachean por `firma` y los reruns (selector, multiselect,
+    botón de ruta) reutilizan las mismas capas.
+    """
+    # Capa de iconos (biorreactores + Matriz 🏠)
+    layer_icon = pdk.Layer(
+        "IconLayer",
+        data=_df_map,
+        get_icon="icon_data",
+        get_position="[longitud, latitud]",
+        size_scale=15,
+        get_size=2,
+        pickable=True,
+    )
+
+    # Capa de labels "BIM X" y "Matriz"
+    df_labels = _df_map.assign(title=_df_map["label"].astype(str))
+    layer_label = pdk.Layer(
+        "TextLayer",
+        data=df_labels,
+        get_position="[longitud, latitud]",
+        get_text="title",
+        get_size=14,
+        get_color=[255, 255, 255],
+        get_text_anchor="start",
+        get_alignment_baseline="center",
+        get_pixel_offset=[18, 0],
+    )
+    return layer_icon, layer_label
+
 def view_map():
     st.markdown(
         '<a class="btn-link" href="?page=home" target="_self">⬅️ Volver al Panel General</a>',
@@ -401,11 +639,6 @@ def view_map():
         st.info("No existen coordenadas registradas para los biorreactores.")
         return
 
-    import pydeck as pdk
-
-    df_map["cliente"] = df_map["cliente"].astype("string").str.strip()
-    df_map["numero_bim"] = df_map["numero_bim"].astype("string")
-
     # 1) Selector de UN BIM solo para centrar el mapa (incluye MATRIZ)
     bims_opts = sorted(df_map["numero_bim"].unique().tolist())
     bim_focus = st.selectbox(
@@ -426,30 +659,8 @@ def view_map():
     zoom = 12
     view = pdk.ViewState(latitude=lat0, longitude=lon0, zoom=zoom, pitch=0)
 
-    # Capa de iconos (biorreactores + Matriz 🏠)
-    layer_icon = pdk.Layer(
-        "IconLayer",
-        data=df_map,
-        get_icon="icon_data",
-        get_position="[longitud, latitud]",
-        size_scale=15,
-        get_size=2,
-        pickable=True,
-    )
-
-    # Capa de labels "BIM X" y "Matriz"
-    df_map["title"] = df_map["label"].astype(str)
-    layer_label = pdk.Layer(
-        "TextLayer",
-        data=df_map,
-        get_position="[longitud, latitud]",
-        get_text="title",
-        get_size=14,
-        get_color=[255, 255, 255],
-        get_text_anchor="start",
-        get_alignment_baseline="center",
-        get_pixel_offset=[18, 0],
-    )
+    # Capas fijas (iconos + etiquetas): se reconstruyen solo si cambian los datos
+    layer_icon, layer_label = _capas_base(df_map, _firma_mapa(df_map))
 
     # 2) Planificador de ruta por carretera (independiente del selector de BIM)
     st.subheader("🧭 Planificador de ruta")
@@ -490,8 +701,8 @@ def view_map():
 
             # 2) Coordenadas en el orden calculado para la API de rutas (lon, lat)
             coords = [
-                [float(row["longitud"]), float(row["latitud"])]
-                for _, row in route_df.iterrows()
+                [float(lon), float(lat)]
+                for lon, lat in zip(route_df["longitud"].to_numpy(), route_df["latitud"].to_numpy())
             ]
 
             # 3) Ruta real por carretera con ORS
@@ -544,14 +755,25 @@ def view_map():
 # ==========================================================
 # Detalle del biorreactor
 # ==========================================================
+def _paginador(total: int, key: str) -> int:
+    """Selector de página para una tabla de `total` filas; devuelve la página elegida (1..n)."""
+    paginas = max(1, -(-total // PAGE_SIZE))
+    if paginas == 1:
+        return 1
+    pagina = st.number_input("Página", min_value=1, max_value=paginas, value=1, step=1, key=key)
+    st.caption(f"Página {pagina} de {paginas} · {PAGE_SIZE} filas por página")
+    return int(pagina)
+
+def _o_guion(v):
+    """Valor para mostrar, o '—' si viene vacío (NULL de MySQL como None o NaN, o '')."""
+    return "—" if v is None or v == "" or pd.isna(v) else v
+
 def view_detail():
-    catalogo = get_biorreactores()
-    bim = str(st.session_state.selected_bim) if st.session_state.selected_bim else None
+    bim = st.query_params.get("bim") or None
+    sel = get_biorreactor(bim) if bim else None
 
-    if not bim or bim not in set(catalogo["numero_bim"].astype("string")):
-        st.info("Biorreactor no encontrado. Regresando al panel general…")
-        go_home()
-        st.stop()
+    if sel is None:
+        go_home(aviso="Biorreactor no encontrado. Se volvió al panel general.")
 
     st.markdown(
         '<a class="btn-link" href="?page=home" target="_self">⬅️ Volver al Panel General</a>',
@@ -559,70 +781,95 @@ def view_detail():
     )
     st.title(f"🧬 Detalle del biorreactor {bim}")
 
-    sel = catalogo[catalogo["numero_bim"].astype("string") == bim].iloc[0]
-
     c1, c2 = st.columns(2)
     with c1:
         st.markdown(f"**Cliente:** {sel.get('cliente') or '—'}")
-        st.markdown(f"**Microalga cultivada:** {sel.get('tipo_microalga') or '—'}")
-        st.markdown(f"**Tipo de aireador:** {sel.get('tipo_aireador') or '—'}")
+        st.markdown(f"**Microalga cultivada:** {_o_guion(sel.get('tipo_microalga'))}")
+        st.markdown(f"**Tipo de aireador:** {_o_guion(sel.get('tipo_aireador'))}")
         st.markdown(f"**Altura del biorreactor:** {sel.get('altura_bim') or '—'} m")
     with c2:
-        luz = sel.get('uso_luz_artificial')
-        st.markdown(f"**Luz artificial:** {'Sí' if bool(luz) else 'No' if luz is not None else '—'}")
-        st.markdown(f"**Fecha de instalación:** {sel.get('fecha_instalacion') or '—'}")
+        st.markdown(f"**Luz artificial:** {sel['luz_display']}")
+        st.markdown(f"**Fecha de instalación:** {_o_guion(sel.get('fecha_instalacion'))}")
         st.markdown(f"**Coordenadas:** ({sel.get('latitud') or '—'}, {sel.get('longitud') or '—'})")
 
     st.divider()
+    _detalle_tablas(bim)
+
+@st.fragment
+def _detalle_tablas(bim: str):
+    """
+    Rango de fechas + pestañas del detalle. Como fragmento, cambiar fechas, página o
+    selección sólo re-ejecuta este bloque (no la cabecera ni el resto del script).
+    """
     hoy = datetime.utcnow().date()
-    d1 = datetime.combine(st.date_input("Desde", hoy - timedelta(days=30), key="d1_detail"), datetime.min.time())
-    d2 = datetime.combine(st.date_input("Hasta", hoy, key="d2_detail"), datetime.max.time())
+    d1 = st.date_input("Desde", hoy - timedelta(days=30), key="d1_detail")
+    d2 = st.date_input("Hasta", hoy, key="d2_detail")
 
     T1, T2, T3 = st.tabs(["Registros", "Diagnósticos", "Eventos del biorreactor"])
 
+    # 1) Totales de las tres pestañas en paralelo (definen métricas y paginadores)
+    total_r, total_d, total_e = _en_paralelo(
+        (get_conteo, "registros", bim, d1, d2),
+        (get_conteo, "diagnosticos", bim, d1, d2),
+        (get_conteo, "eventos", bim, d1, d2),
+    )
+    with T1:
+        st.metric("Total de registros", total_r)
+        pag_r = _paginador(total_r, "pag_registros") if total_r else None
+    with T2:
+        st.metric("Total de diagnósticos", total_d)
+        pag_d = _paginador(total_d, "pag_diagnosticos") if total_d else None
+    with T3:
+        st.metric("Total de eventos", total_e)
+        pag_e = _paginador(total_e, "pag_eventos") if total_e else None
+
+    # 2) Páginas visibles de cada pestaña, también en paralelo (el CSV va a pedido)
+    df_r, df_d, df_e = _en_paralelo(
+        (get_registros, bim, d1, d2, pag_r) if total_r else None,
+        (get_diagnosticos, bim, d1, d2, pag_d) if total_d else None,
+        (get_eventos, bim, d1, d2, pag_e) if total_e else None,
+    )
+
     with T1:
-        df_r = get_registros(bim, d1, d2)
-        st.metric("Total de registros", len(df_r))
-        if df_r.empty:
+        if df_r is None or df_r.empty:
             st.info("Sin registros en el rango indicado.")
         else:
-            st.dataframe(df_r, use_container_width=True)
-            st.download_button(
-                "Descargar CSV",
-                df_r.to_csv(index=False).encode("utf-8"),
-                file_name=f"registros_BIM{bim}.csv",
-            )
+            st.dataframe(df_r, use_container_width=True, hide_index=True)
+            _descarga_csv("registros", bim, d1, d2)
+            reg_id = st.selectbox("Ver registro completo (id)", df_r["id"].tolist(), index=None, key="reg_id_detail")
+            if reg_id is not None:
+                full = get_registro(reg_id)
+                if not full.empty:
+                    st.markdown(f"**Respuesta GPT:** {full['respuestaGPT'].iloc[0] or '—'}")
 
     with T2:
-        df_d = get_diagnosticos(bim, d1, d2)
-        st.metric("Total de diagnósticos", len(df_d))
-        if df_d.empty:
+        if df_d is None or df_d.empty:
             st.info("Sin diagnósticos en el rango indicado.")
         else:
-            st.dataframe(df_d, use_container_width=True)
-            st.download_button(
-                "Descargar CSV",
-                df_d.to_csv(index=False).encode("utf-8"),
-                file_name=f"diagnosticos_BIM{bim}.csv",
-            )
+            st.dataframe(df_d, use_container_width=True, hide_index=True)
+            _descarga_csv("diagnosticos", bim, d1, d2)
+            diag_id = st.selectbox("Ver diagnóstico completo (id)", df_d["id"].tolist(), index=None, key="diag_id_detail")
+            if diag_id is not None:
+                full = get_diagnostico(diag_id)
+                if not full.empty:
+                    st.markdown(f"**Pregunta del cliente:** {full['PreguntaCliente'].iloc[0] or '—'}")
+                    st.markdown(f"**Respuesta GPT:** {full['respuestaGPT'].iloc[0] or '—'}")
 
     with T3:
-        df_e = get_eventos(bim, d1, d2)
-        st.metric("Total de eventos", len(df_e))
-        if df_e.empty:
+        if df_e is None or df_e.empty:
             st.info("Sin eventos registrados para este biorreactor en el rango indicado.")
         else:
-            st.dataframe(df_e, use_container_width=True)
-            st.download_button(
-                "Descargar CSV",
-                df_e.to_csv(index=False).encode("utf-8"),
-                file_name=f"eventos_BIM{bim}.csv",
-            )
+            st.dataframe(df_e, use_container_width=True, hide_index=True)
+            _descarga_csv("eventos", bim, d1, d2)
 
 # ==========================================================
 # Routing
 # ==========================================================
-page = st.session_state.get("page", st.query_params.get("page", "home"))
+# En todas las páginas: fuerza la relectura del catálogo antes de dibujar la vista
+if st.sidebar.button("🔄 Refrescar biorreactores"):
+    refrescar_catalogo()
+
+page = st.query_params.get("page", "home")
 if page == "detail":
     view_detail()
 elif page == "map":
@@ -0,0 +1,24 @@
+# exportacion.py — Exportación CSV de las tablas del detalle
+# -*- coding: utf-8 -*-
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+
+def csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    CSV UTF-8 con el escritor de Arrow (C++, multihilo). Las columnas ya vienen
+    respaldadas por Arrow (dtype_backend="pyarrow"), así que la tabla no se copia.
+
+    El formato NO es idéntico al de DataFrame.to_csv: Arrow entrecomilla siempre los
+    nombres de columna y todos los valores de texto, y escribe las fechas con la
+    precisión de la columna (p. ej. "2024-05-01 10:00:00.000000"). Los valores leídos
+    de vuelta son los mismos (ver tests/test_exportacion.py).
+    """
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(
+        pa.Table.from_pandas(df, preserve_index=False),
+        sink,
+        write_options=pa_csv.WriteOptions(quoting_style="needed"),
+    )
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,21 @@
+-- 001_indexes.sql — índices para las consultas del detalle de biorreactor
+-- Ejecutar una vez sobre la base `technolab` (MySQL 5.7+ / 8.0).
+--
+-- Las tres pestañas del detalle filtran por BIM y rango de fechas
+-- (`fecha >= :d1 AND fecha < :d2`) y ordenan por `fecha DESC`; con un índice
+-- compuesto (BIM, fecha) MySQL resuelve filtro, orden y LIMIT sin recorrer la tabla.
+
+-- Registros: pestaña "Registros" y conteo
+CREATE INDEX ix_registros_bim_fecha ON registros (BIM, fecha);
+
+-- Registros: usuarios distintos de un BIM (JOIN de diagnósticos), solo índice
+CREATE INDEX ix_registros_bim_usuario ON registros (BIM, usuario_id);
+
+-- Diagnósticos: por usuario y rango de fechas
+CREATE INDEX ix_diagnosticos_usuario_fecha ON diagnosticos (usuario_id, fecha);
+
+-- Eventos: pestaña "Eventos" y conteo
+CREATE INDEX ix_fechas_bims_bim_fecha ON fechas_BIMs (numero_bim, fecha);
+
+-- Biorreactores: COUNT(DISTINCT numero_bim) del KPI se resuelve recorriendo solo el índice
+CREATE INDEX ix_biorreactores_numero_bim ON biorreactores (numero_bim);
@@ -0,0 +1,143 @@
+# sentencias.py — Sentencias SQL del Technolab Data Center
+# -*- coding: utf-8 -*-
+"""
+Sentencias SQL como TextClause de SQLAlchemy.
+
+Viven en un módulo aparte porque Streamlit re-ejecuta app.py completo en cada
+rerun; un módulo importado se ejecuta una sola vez por proceso, así que cada
+text() se construye una vez y la caché de compilación del engine lo reutiliza.
+"""
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+# Largo de la vista previa de los campos de texto largos en las tablas del detalle
+PREVIEW_CHARS = 120
+# Filas por página en las tablas del detalle (la descarga CSV siempre va completa)
+PAGE_SIZE = 100
+_PAGINA = "LIMIT :lim OFFSET :off"
+
+SQL_CLIENTES = text("SELECT id, usuario_id, usuario_nombre, cliente, BIMs_instalados FROM clientes")
+
+_COLS_BIORREACTOR = """
+       id,
+       TRIM(COALESCE(cliente, '')) AS cliente,
+       TRIM(CAST(numero_bim AS CHAR CHARACTER SET utf8mb4)) AS numero_bim,
+       latitud, longitud, altura_bim,
+       tipo_microalga, uso_luz_artificial, tipo_aireador,
+       `fecha_instalación` AS fecha_instalacion
+"""
+
+SQL_BIORREACTORES = text(f"""
+    SELECT {_COLS_BIORREACTOR}
+    FROM biorreactores
+    ORDER BY cliente, numero_bim
+""")
+
+# Ficha de un solo BIM para el detalle. Compara contra el MISMO código normalizado
+# que expone el catálogo (botones y URL) y, si hay BIMs repetidos, toma el primero
+# en el orden del catálogo. biorreactores es una tabla chica: el recorrido es barato.
+SQL_BIORREACTOR_POR_BIM = text(f"""
+    SELECT {_COLS_BIORREACTOR}
+    FROM biorreactores
+    WHERE TRIM(CAST(numero_bim AS CHAR CHARACTER SET utf8mb4)) = :bim
+    ORDER BY cliente, numero_bim
+    LIMIT 1
+""")
+
+def _sql_eventos(pagina: str) -> TextClause:
+    return text(f"""
+        SELECT id, numero_bim, nombre_evento, fecha, comentarios
+        FROM fechas_BIMs
+        WHERE numero_bim = :bim AND fecha >= :d1 AND fecha < :d2
+        ORDER BY fecha DESC
+        {pagina}
+    """)
+
+# Indexado por `completo`: False = una página de la tabla, True = rango completo (CSV)
+SQL_EVENTOS = {
+    False: _sql_eventos(_PAGINA),
+    True: _sql_eventos(""),
+}
+
+def _sql_diagnosticos(textos: str, pagina: str) -> TextClause:
+    return text(f"""
+        SELECT d.id, d.usuario_id, {textos}, d.fecha
+        FROM diagnosticos d
+        JOIN (SELECT DISTINCT usuario_id FROM registros WHERE BIM = :bim) u
+          ON u.usuario_id = d.usuario_id
+        WHERE d.fecha >= :d1 AND d.fecha < :d2
+        ORDER BY d.fecha DESC
+        {pagina}
+    """)
+
+# False = página con vista previa de textos, True = rango completo con columnas completas
+SQL_DIAGNOSTICOS = {
+    False: _sql_diagnosticos(
+        f"LEFT(d.PreguntaCliente, {PREVIEW_CHARS}) AS PreguntaCliente, "
+        f"LEFT(d.respuestaGPT, {PREVIEW_CHARS}) AS respuestaGPT",
+        _PAGINA,
+    ),
+    True: _sql_diagnosticos("d.PreguntaCliente, d.respuestaGPT", ""),
+}
+
+def _sql_registros(respuesta: str, pagina: str) -> TextClause:
+    return text(f"""
+        SELECT id, usuario_id, BIM, {respuesta}, HEX, fecha
+        FROM registros
+        WHERE BIM = :bim AND fecha >= :d1 AND fecha < :d2
+        ORDER BY fecha DESC
+        {pagina}
+    """)
+
+SQL_REGISTROS = {
+    False: _sql_registros(f"LEFT(respuestaGPT, {PREVIEW_CHARS}) AS respuestaGPT", _PAGINA),
+    True: _sql_registros("respuestaGPT", ""),
+}
+
+# Totales por pestaña (para el paginador y las métricas)
+SQL_CONTEOS = {
+    "registros": text("""
+        SELECT COUNT(*) AS n FROM registros
+        WHERE BIM = :bim AND fecha >= :d1 AND fecha < :d2
+    """),
+    "diagnosticos": text("""
+        SELECT COUNT(*) AS n
+        FROM diagnosticos d
+        JOIN (SELECT DISTINCT usuario_id FROM registros WHERE BIM = :bim) u
+          ON u.usuario_id = d.usuario_id
+        WHERE d.fecha >= :d1 AND d.fecha < :d2
+    """),
+    "eventos": text("""
+        SELECT COUNT(*) AS n FROM fechas_BIMs
+        WHERE numero_bim = :bim AND fecha >= :d1 AND fecha < :d2
+    """),
+}
+
+SQL_REGISTRO_POR_ID = text("""
+    SELECT id, usuario_id, BIM, respuestaGPT, HEX, fecha
+    FROM registros WHERE id = :id
+""")
+
+SQL_DIAGNOSTICO_POR_ID = text("""
+    SELECT id, usuario_id, PreguntaCliente, respuestaGPT, fecha
+    FROM diagnosticos WHERE id = :id
+""")
+
+# Todos los KPIs en un solo viaje a MySQL (conteos y DISTINCT resueltos en el servidor)
+SQL_KPIS = text("""
+    SELECT
+       (SELECT COUNT(*) FROM clientes)                              AS tc,
+       (SELECT COALESCE(SUM(BIMs_instalados), 0) FROM clientes)     AS sc,
+       (SELECT COUNT(DISTINCT numero_bim) FROM biorreactores
+         WHERE numero_bim IS NOT NULL)                              AS db,
+       (SELECT COUNT(*) FROM diagnosticos)                          AS td,
+       (SELECT COUNT(*) FROM registros)                             AS tr,
+       (SELECT COUNT(*) FROM fechas_BIMs)                           AS te
+""")
+
+# Rango completo con textos completos, solo para la descarga CSV
+SQL_CSV = {
+    "registros": SQL_REGISTROS[True],
+    "diagnosticos": SQL_DIAGNOSTICOS[True],
+    "eventos": SQL_EVENTOS[True],
+}
@@ -0,0 +1,36 @@
+"""Compara exportacion.csv_bytes con DataFrame.to_csv sobre una muestra del detalle."""
+import io
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from exportacion import csv_bytes  # noqa: E402
+
+
+def _muestra() -> pd.DataFrame:
+    # Mismos tipos que entrega q(..., arrow=True) para las tablas del detalle
+    df = pd.DataFrame({
+        "id": [1, 2, 3],
+        "BIM": ["7", "7", "12"],
+        "respuestaGPT": ['Riego "normal", sin cambios', None, "línea 1\nlínea 2"],
+        "fecha": pd.to_datetime(["2024-05-01 10:00:00", "2024-05-02 08:30:15", None]),
+    })
+    return df.convert_dtypes(dtype_backend="pyarrow")
+
+
+def test_mismos_valores_que_to_csv():
+    df = _muestra()
+    arrow = pd.read_csv(io.BytesIO(csv_bytes(df)), parse_dates=["fecha"], dtype={"BIM": str})
+    pandas = pd.read_csv(io.BytesIO(df.to_csv(index=False).encode("utf-8")),
+                         parse_dates=["fecha"], dtype={"BIM": str})
+    pd.testing.assert_frame_equal(arrow, pandas)
+
+
+def test_diferencias_de_formato_documentadas():
+    texto = csv_bytes(_muestra()).decode("utf-8")
+    encabezado = texto.splitlines()[0]
+    assert encabezado == '"id","BIM","respuestaGPT","fecha"'
+    assert '"7"' in texto                      # textos siempre entre comillas
+    assert "2024-05-01 10:00:00.000000" in texto  # precisión de la columna (us)